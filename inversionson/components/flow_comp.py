@@ -17,6 +17,11 @@ from salvus.flow.api import get_site
 from inversionson import InversionsonError
 from salvus.mesh.unstructured_mesh import UnstructuredMesh
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 
 class SalvusFlowComponent(Component):
     """
@@ -597,6 +602,31 @@ class SalvusFlowComponent(Component):
 
         return w
 
+    def _simulation_dict_folder(self, event: str) -> pathlib.Path:
+        # Always write events to the same folder
+        return (
+            self.comm.lasif.lasif_comm.project.paths["salvus_files"]
+            / "SIMULATION_DICTS"
+            / event
+        )
+
+    def find_local_simulation_dict(self, event: str) -> Union[pathlib.Path, None]:
+        """
+        Find the downloaded simulation dictionary of an event, if there is one.
+        A msgpack dictionary is preferred over a toml one.
+
+        :param event: Name of event
+        :type event: str
+        """
+        folder = self._simulation_dict_folder(event)
+        filenames = ["simulation_dict.toml"]
+        if msgpack is not None:
+            filenames.insert(0, "simulation_dict.msgpack")
+        for filename in filenames:
+            if os.path.exists(folder / filename):
+                return folder / filename
+        return None
+
     def construct_simulation_from_dict(self, event: str):
         """
         Download a dictionary with the simulation object and use it to create a local simulation object
@@ -607,25 +637,26 @@ class SalvusFlowComponent(Component):
         :type event: str
         """
 
-        # Always write events to the same folder
-        destination = (
-            self.comm.lasif.lasif_comm.project.paths["salvus_files"]
-            / f"SIMULATION_DICTS"
-            / event
-            / "simulation_dict.toml"
-        )
-        if not os.path.exists(destination.parent):
-            os.makedirs(destination.parent)
-
-        if not os.path.exists(destination):
+        destination = self.find_local_simulation_dict(event)
+        if destination is None:
             hpc_cluster = sapi.get_site(self.comm.project.site_name)
             interp_job = self.get_job(event, sim_type="prepare_forward")
-            remote_dict = (
-                interp_job.stdout_path.parent / "output" / "simulation_dict.toml"
-            )
+            remote_output = interp_job.stdout_path.parent / "output"
+            # Prefer the msgpack dictionary, jobs only write the toml one
+            # with --legacy-toml or if msgpack is missing on the remote.
+            remote_dict = remote_output / "simulation_dict.msgpack"
+            if msgpack is None or not hpc_cluster.remote_exists(remote_dict):
+                remote_dict = remote_output / "simulation_dict.toml"
+            destination = self._simulation_dict_folder(event) / remote_dict.name
+            if not os.path.exists(destination.parent):
+                os.makedirs(destination.parent)
             hpc_cluster.remote_get(remotepath=remote_dict, localpath=destination)
 
-        sim_dict = toml.load(destination)
+        if destination.suffix == ".msgpack":
+            with open(destination, "rb") as fh:
+                sim_dict = msgpack.unpack(fh, raw=False)
+        else:
+            sim_dict = toml.load(destination)
 
         local_dummy_mesh_path = self.comm.lasif.get_master_model()
         local_dummy_mesh = self.comm.lasif.get_master_mesh()
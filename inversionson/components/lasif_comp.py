@@ -2,17 +2,13 @@ from __future__ import absolute_import
 import shutil
 
 from lasif.components.component import Component
-import lasif.api as lapi
-from lasif.utils import write_custom_stf
 import os
 from inversionson import InversionsonError, InversionsonWarning
 import warnings
 import toml
 import pathlib
 
-from salvus.flow.api import get_site
 from typing import List, Dict, Union
-from salvus.mesh.unstructured_mesh import UnstructuredMesh
 
 class LasifComponent(Component):
     """
@@ -27,6 +23,15 @@ class LasifComponent(Component):
         self.everything_processed = False
         self.validation_data_processed = False
         self.master_mesh = None
+        # Listing events and iterations scans the LASIF project on disk,
+        # so we keep the results around.
+        self._events_cache = None
+        self._events_frozen = None
+        self._iterations_cache = None
+        # Event meshes which have been found, {event: mesh_path}
+        self._event_mesh_cache = {}
+        # Events with processed data
+        self._processed_cache = None
 
     def print(
         self,
@@ -51,13 +56,16 @@ class LasifComponent(Component):
 
         from lasif.components.project import Project
 
-        folder = pathlib.Path(self.lasif_root).absolute()
+        folder = os.path.abspath(self.lasif_root)
         max_folder_depth = 4
 
         for _ in range(max_folder_depth):
-            if (folder / "lasif_config.toml").exists():
-                return Project(folder).get_communicator()
-            folder = folder.parent
+            if os.path.isfile(os.path.join(folder, "lasif_config.toml")):
+                return Project(pathlib.Path(folder)).get_communicator()
+            parent = os.path.dirname(folder)
+            if parent == folder:
+                break
+            folder = parent
         raise ValueError(f"Path {self.lasif_root} is not a LASIF project")
 
     def has_iteration(self, it_name: str) -> bool:
@@ -68,7 +76,7 @@ class LasifComponent(Component):
         :type name: str
         :return: True if lasif has the iteration
         """
-        iterations = lapi.list_iterations(self.lasif_comm, output=True, verbose=False)
+        iterations = self._list_iterations_cached()
         if it_name.startswith("ITERATION_"):
             it_name = it_name.replace("ITERATION_", "")
         if isinstance(iterations, list):
@@ -101,6 +109,8 @@ class LasifComponent(Component):
         :type iteration: str, optional
         """
 
+        from salvus.flow.api import get_site
+
         if hpc_cluster is None:
             hpc_cluster = get_site(self.comm.project.interpolation_site)
         mesh = self.find_remote_mesh(
@@ -148,6 +158,9 @@ class LasifComponent(Component):
         :return: The path to the correct mesh
         :rtype: pathlib.Path
         """
+
+        from salvus.flow.api import get_site
+
         if hpc_cluster is None:
             hpc_cluster = get_site(self.comm.project.interpolation_site)
         remote_mesh_dir = pathlib.Path(self.comm.project.remote_mesh_dir)
@@ -212,10 +225,31 @@ class LasifComponent(Component):
                 event, gradient=False, hpc_cluster=hpc_cluster
             )
         else:
-            has, _ = lapi.find_event_mesh(self.lasif_comm, event)
+            has, _ = self._find_event_mesh_cached(event)
 
         return has
 
+    def _find_event_mesh_cached(self, event: str):
+        """
+        Lasif find event mesh, but meshes which have been found once are
+        remembered. Missing meshes are not cached as they may be created
+        later on.
+
+        :param event: Name of event
+        :type event: str
+        :return: Whether the mesh exists and the path to it
+        :rtype: Tuple[bool, str]
+        """
+
+        import lasif.api as lapi
+
+        if event in self._event_mesh_cache:
+            return True, self._event_mesh_cache[event]
+        has, mesh = lapi.find_event_mesh(self.lasif_comm, event)
+        if has:
+            self._event_mesh_cache[event] = mesh
+        return has, mesh
+
     def find_event_mesh(self, event: str) -> pathlib.Path:
         """
         Find the path for an event mesh
@@ -230,7 +264,7 @@ class LasifComponent(Component):
                 "domain_file"
             ]
             return mesh
-        has, mesh = lapi.find_event_mesh(self.lasif_comm, event)
+        has, mesh = self._find_event_mesh_cached(event)
         if not has:
             raise InversionsonError(f"Mesh for event: {event} can not be found.")
         return pathlib.Path(mesh)
@@ -242,6 +276,9 @@ class LasifComponent(Component):
         :param event: Name of event
         :type event: str
         """
+
+        from salvus.flow.api import get_site
+
         if event is None:
             if gradient:
                 self.print(
@@ -253,7 +290,7 @@ class LasifComponent(Component):
                 self.print("Moving model to cluster", emoji_alias=":package:")
                 self._move_model_to_cluster(hpc_cluster)
             return
-        has, event_mesh = lapi.find_event_mesh(self.lasif_comm, event)
+        has, event_mesh = self._find_event_mesh_cached(event)
 
         if not has:
             raise InversionsonError(f"Mesh for event {event} does not exist.")
@@ -291,6 +328,9 @@ class LasifComponent(Component):
         :param overwrite: Overwrite mesh already there?, defaults to False
         :type overwrite: bool, optional
         """
+
+        from salvus.flow.api import get_site
+
         if hpc_cluster is None:
             hpc_cluster = get_site(self.comm.project.interpolation_site)
 
@@ -335,6 +375,9 @@ class LasifComponent(Component):
         :param hpc_cluster: A Salvus site object, defaults to None
         :type hpc_cluster: salvus.flow.Site, optional
         """
+
+        from salvus.flow.api import get_site
+
         if hpc_cluster is None:
             hpc_cluster = get_site(self.comm.project.interpolation_site)
 
@@ -354,8 +397,7 @@ class LasifComponent(Component):
             return
 
         local_grad = self.lasif_comm.project.paths["models"] / "GRADIENT" / "mesh.h5"
-        if not os.path.exists(local_grad.parent):
-            os.makedirs(local_grad.parent)
+        os.makedirs(local_grad.parent, exist_ok=True)
         inversion_grid = self.get_master_model()
         shutil.copy(inversion_grid, local_grad)
         self.comm.salvus_mesher.fill_inversion_params_with_zeroes(local_grad)
@@ -373,6 +415,8 @@ class LasifComponent(Component):
         :param iteration: Name of iteration
         :type iteration: str
         """
+
+        import lasif.api as lapi
         import shutil
 
         # If we use mono-mesh we copy the salvus opt mesh here.
@@ -398,7 +442,7 @@ class LasifComponent(Component):
                 self._move_mesh_to_cluster(event=event, hpc_cluster=hpc_cluster)
             return
 
-        has, event_mesh = lapi.find_event_mesh(self.lasif_comm, event)
+        has, event_mesh = self._find_event_mesh_cached(event)
 
         if not has:
             raise ValueError(f"{event_mesh} does not exist")
@@ -407,8 +451,7 @@ class LasifComponent(Component):
                 self.lasif_comm, event, iteration
             )
             if not os.path.exists(event_iteration_mesh):
-                if not os.path.exists(os.path.dirname(event_iteration_mesh)):
-                    os.makedirs(os.path.dirname(event_iteration_mesh))
+                os.makedirs(os.path.dirname(event_iteration_mesh), exist_ok=True)
                 shutil.copy(event_mesh, event_iteration_mesh)
                 event_xdmf = event_mesh[:-2] + "xdmf"
                 event_iteration_xdmf = event_iteration_mesh[:-2] + "xdmf"
@@ -435,7 +478,10 @@ class LasifComponent(Component):
         :param events: list of events used in iteration, defaults to []
         :type events: list, optional
         """
-        iterations = lapi.list_iterations(self.lasif_comm, output=True, verbose=False)
+
+        import lasif.api as lapi
+
+        iterations = self._list_iterations_cached()
         if isinstance(iterations, list):
             if name in iterations:
                 warnings.warn(f"Iteration {name} already exists", InversionsonWarning)
@@ -448,6 +494,29 @@ class LasifComponent(Component):
             events=events,
             event_specific=event_specific,
         )
+        # The iteration list changed on disk
+        self.invalidate_iterations_cache()
+
+    def invalidate_iterations_cache(self):
+        """
+        Forget the cached list of iterations. Needs to be called after
+        iterations are added or removed without going through this class.
+        """
+        self._iterations_cache = None
+
+    def _list_iterations_cached(self):
+        """
+        Lasif list iterations, only scans the project the first time
+        and after the iterations have changed.
+        """
+
+        import lasif.api as lapi
+
+        if self._iterations_cache is None:
+            self._iterations_cache = lapi.list_iterations(
+                self.lasif_comm, output=True, verbose=False
+            )
+        return self._iterations_cache
 
     def list_events(self, iteration=None):
         """
@@ -458,9 +527,35 @@ class LasifComponent(Component):
         :param iteration: Name of iteration, defaults to None
         :type iteration: str
         """
-        return lapi.list_events(
-            self.lasif_root, just_list=True, iteration=iteration, output=True
-        )
+
+        import lasif.api as lapi
+
+        if iteration is not None:
+            return lapi.list_events(
+                self.lasif_root, just_list=True, iteration=iteration, output=True
+            )
+        # The events of a project do not change, so we only list them once
+        if self._events_cache is None:
+            self._events_cache = lapi.list_events(
+                self.lasif_root, just_list=True, iteration=None, output=True
+            )
+        return list(self._events_cache)
+
+    def list_events_set(self, iteration=None) -> frozenset:
+        """
+        Same as list_events, but returns a frozenset for callers that do
+        set operations on the events. The set of all events is only built
+        once.
+
+        :param iteration: Name of iteration, defaults to None
+        :type iteration: str
+        """
+        if iteration is None and self._events_frozen is not None:
+            return self._events_frozen
+        events = frozenset(self.list_events(iteration))
+        if iteration is None:
+            self._events_frozen = events
+        return events
 
     def find_stf(self, iteration: str) -> pathlib.Path:
         """
@@ -481,6 +576,10 @@ class LasifComponent(Component):
         :param iteration: Name of iteration
         :type iteration: str
         """
+
+        from salvus.flow.api import get_site
+        from lasif.utils import write_custom_stf
+
         local_stf = self.find_stf(iteration=iteration)
         if not os.path.exists(local_stf):
             write_custom_stf(stf_path=local_stf, comm=self.lasif_comm)
@@ -535,6 +634,9 @@ class LasifComponent(Component):
         :return: Mesh of inversion grid
         :rtype: UnstructuredMesh
         """
+
+        from salvus.mesh.unstructured_mesh import UnstructuredMesh
+
         # We assume the lasif domain is the inversion grid
         if self.master_mesh is None:
             path = self.lasif_comm.project.lasif_config["domain_settings"][
@@ -551,6 +653,9 @@ class LasifComponent(Component):
         :return: Dictionary with source information
         :rtype: dict
         """
+
+        import lasif.api as lapi
+
         return lapi.get_source(
             self.lasif_comm, event_name, self.comm.project.current_iteration
         )
@@ -565,6 +670,9 @@ class LasifComponent(Component):
         :return: A list of receiver dictionaries
         :rtype: dict
         """
+
+        import lasif.api as lapi
+
         return lapi.get_receivers(
             lasif_root=self.lasif_comm, event=event_name, load_from_file=True
         )
@@ -578,6 +686,9 @@ class LasifComponent(Component):
         :return: Path to a mesh
         :rtype: str
         """
+
+        import lasif.api as lapi
+
         if iteration == "current":
             iteration = self.comm.project.current_iteration
         if self.comm.project.meshes == "multi-mesh":
@@ -616,6 +727,9 @@ class LasifComponent(Component):
         :param event: Name of event
         :type event: str
         """
+
+        import lasif.api as lapi
+
         # Name weight set after event to know it
         weight_set_name = event
         # If set exists, we don't recalculate it
@@ -645,6 +759,8 @@ class LasifComponent(Component):
         :type window: str, optional
         """
 
+        import lasif.api as lapi
+
         iteration = self.comm.project.current_iteration
         if window_set is None:
             if self.comm.project.inversion_mode == "mini-batch":
@@ -750,9 +866,28 @@ class LasifComponent(Component):
         )
         processed_data_folder = self.lasif_comm.project.paths["preproc_eq_data"]
 
-        return os.path.exists(
+        # Scan for all the processed events at once the first time around
+        if self._processed_cache is None:
+            self._processed_cache = set()
+            if os.path.isdir(processed_data_folder):
+                with os.scandir(processed_data_folder) as it:
+                    self._processed_cache = {
+                        entry.name
+                        for entry in it
+                        if os.path.isfile(
+                            os.path.join(entry.path, processed_filename)
+                        )
+                    }
+        if event in self._processed_cache:
+            return True
+
+        # The event may have been processed since the scan
+        if os.path.exists(
             os.path.join(processed_data_folder, event, processed_filename)
-        )
+        ):
+            self._processed_cache.add(event)
+            return True
+        return False
 
     def process_data(self, event: str):
         """
@@ -761,6 +896,10 @@ class LasifComponent(Component):
         :param event: Name of event to be processed
         :type event: str
         """
+
+        import lasif.api as lapi
+        from salvus.flow.api import get_site
+
         if self._already_processed(event):
             return
 
@@ -775,8 +914,7 @@ class LasifComponent(Component):
                 lasif_root, "PROCESSED_DATA", "EARTHQUAKES", event)
             local_proc_file = os.path.join(local_proc_folder, proc_filename)
 
-            if not os.path.exists(local_proc_folder):
-                os.mkdir(local_proc_folder)
+            os.makedirs(local_proc_folder, exist_ok=True)
 
             remote_proc_file_name = f"{event}_{proc_filename}"
             hpc_cluster = get_site(self.comm.project.site_name)
@@ -811,6 +949,8 @@ class LasifComponent(Component):
         :rtype: bool
         """
 
+        import lasif.api as lapi
+
         events_in_iteration = self.comm.project.events_in_iteration
         events = self.comm.lasif.list_events()
         validation_events = self.comm.project.validation_dataset
@@ -866,6 +1006,9 @@ class LasifComponent(Component):
         :param event: Name of event to pick windows on
         :type event: str
         """
+
+        import lasif.api as lapi
+
         # Check if window set exists:
         path = os.path.join(
             self.lasif_root, "SETS", "WINDOWS", f"{window_set_name}.sqlite"
@@ -902,7 +1045,6 @@ class LasifComponent(Component):
         event_folder = os.path.join(
             self.lasif_root, "SYNTHETICS", "EARTHQUAKES", iteration, event
         )
-        if not os.path.exists(event_folder):
-            os.mkdir(event_folder)
+        os.makedirs(event_folder, exist_ok=True)
 
         return os.path.join(event_folder, "receivers.h5")
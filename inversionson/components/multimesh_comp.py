@@ -11,6 +11,11 @@ import pathlib
 import toml
 from typing import Union, List
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 REMOTE_SCRIPT_PATHS = os.path.join(
     os.path.dirname(
         os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
@@ -256,15 +261,12 @@ class MultiMeshComponent(Component):
 
             # ALso add a check if the forward_dict exists here
             forward_simulation_dict = (
-                    self.comm.lasif.lasif_comm.project.paths["salvus_files"]
-                    / f"SIMULATION_DICTS"
-                    / event
-                    / "simulation_dict.toml"
+                self.comm.salvus_flow.find_local_simulation_dict(event)
             )
             # Submit a job either if the local dict is missing or
             # if the processed data is missing on the remote
             if not hpc_cluster.remote_exists(remote_proc_path) \
-                    or not os.path.exists(forward_simulation_dict):
+                    or forward_simulation_dict is None:
                 wall_time += self.comm.project.remote_data_proc_wall_time
             elif self.comm.project.meshes != "multi-mesh":
                 self.comm.project.change_attribute(
@@ -379,15 +381,10 @@ class MultiMeshComponent(Component):
             # remote mesh files and also we don't need to create the simulation
             # dict again in the interpolation job.
             local_simulation_dict = (
-                self.comm.lasif.lasif_comm.project.paths["salvus_files"]
-                / f"SIMULATION_DICTS"
-                / event
-                / "simulation_dict.toml"
+                self.comm.salvus_flow.find_local_simulation_dict(event)
             )
             # Only create simulation dict when we don't have it yet.
-            information["create_simulation_dict"] = (
-                False if os.path.exists(local_simulation_dict) else True
-            )
+            information["create_simulation_dict"] = local_simulation_dict is None
 
             if not gradient:
                 if self.comm.project.ellipticity:
@@ -525,6 +522,15 @@ class MultiMeshComponent(Component):
             hpc_cluster=hpc_cluster,
         )
 
+        # The simulation dict is validated in full when it is turned back
+        # into a simulation object locally, no need to do it twice.
+        interpolate_command = (
+            "INVERSIONSON_SKIP_VALIDATE=1 python interpolate.py ./interp_info.toml"
+        )
+        # Without msgpack here, the simulation dict has to come as toml
+        if msgpack is None:
+            interpolate_command += " --legacy-toml"
+
         commands = [
             remote_io_site.site_utils.RemoteCommand(
                 command=f"cp {remote_toml} ./interp_info.toml",
@@ -542,7 +548,7 @@ class MultiMeshComponent(Component):
                 command="mkdir output", execute_with_mpi=False
             ),
             remote_io_site.site_utils.RemoteCommand(
-                command="python interpolate.py ./interp_info.toml",
+                command=interpolate_command,
                 execute_with_mpi=False,
             ),
         ]
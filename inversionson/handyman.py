@@ -54,6 +54,7 @@ class HandyMan(object):
                 iteration=self.optimizer.iteration_name,
                 remove_dirs=True,
             )
+            self.comm.lasif.invalidate_iterations_cache()
         iteration_toml = (
             self.comm.project.paths["documentation"]
             / "ITERATIONS"
@@ -82,6 +83,7 @@ class HandyMan(object):
                 iteration=self.optimizer.iteration_name,
                 remove_dirs=True,
             )
+            self.comm.lasif.invalidate_iterations_cache()
         iteration_toml = (
             self.comm.project.paths["documentation"]
             / "ITERATIONS"
@@ -114,6 +116,7 @@ class HandyMan(object):
             if os.path.exists(filename):
                 os.remove(filename)
         os.remove(self.optimizer.model_path)
+        self.optimizer.invalidate_iteration_cache()
 
     # I'll write down functions that I think it should do before implementing them
     def go_back_one_iteration(self, verbose=True):
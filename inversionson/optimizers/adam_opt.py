@@ -10,7 +10,7 @@ from inversionson import InversionsonError
 from inversionson.optimizers.optimizer import Optimize
 from inversionson.helpers.regularization_helper import RegularizationHelper
 from inversionson.helpers.gradient_summer import GradientSummer
-from inversionson.utils import write_xdmf
+from inversionson.utils import write_xdmf, read_toml
 
 
 class AdamOpt(Optimize):
@@ -114,7 +114,7 @@ class AdamOpt(Optimize):
         """Reads the config file."""
         if not os.path.exists(self.config_file):
             raise Exception("Can't read the ADAM config file")
-        config = toml.load(self.config_file)
+        config = read_toml(self.config_file)
 
         self.initial_model = config["initial_model"]
         self.alpha = config["alpha"]
@@ -164,10 +164,10 @@ class AdamOpt(Optimize):
         ]
 
         for folder in folders:
-            if not os.path.exists(folder):
-                os.mkdir(folder)
+            os.makedirs(folder, exist_ok=True)
 
         shutil.copy(self.initial_model, self.model_path)
+        self.invalidate_iteration_cache()
         write_xdmf(self.model_path)
 
     def _issue_first_task(self):
@@ -290,9 +290,10 @@ class AdamOpt(Optimize):
             with h5py.File(self.first_moment_path, "r+") as h5:
                 data = h5["MODEL/data"]
 
-                # initialize with zeros
+                # initialize with zeros, no need to read the planes first
+                zeros = np.zeros((data.shape[0], data.shape[2]), dtype=data.dtype)
                 for i in indices:
-                    data[:, i, :] = np.zeros_like(data[:, i, :])
+                    data[:, i, :] = zeros
 
             # Also initialize second moments with zeros
             shutil.copy(self.first_moment_path, self.second_moment_path)
@@ -721,6 +722,7 @@ class AdamOpt(Optimize):
                 self.tmp_model_path,
                 target_location,
             )
+            self.invalidate_iteration_cache()
             write_xdmf(target_location)
         else:
             self._update_task_file()
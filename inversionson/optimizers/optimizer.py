@@ -4,23 +4,46 @@ have in common. The class serves the purpose of making it easy to add
 a custom optimizer to Inversionson. Whenever the custom optimizer has a 
 task which works the same as in the base class. It should aim to use that one.
 """
+import functools
 import sys
 from abc import abstractmethod as _abstractmethod
 from pathlib import Path
 import os
-import glob
 import h5py
 import pathlib
 import toml
 import numpy as np
 from typing import List, Union
 
-from lasif.tools.query_gcmt_catalog import get_random_mitchell_subset
-from salvus.flow.api import get_site
 from inversionson import InversionsonError
-from inversionson.utils import write_xdmf
+from inversionson.utils import write_xdmf, read_toml
 import shutil
 
+# Raw data chunk cache settings used when opening model files. The h5py
+# default of 1 MiB is too small for the chunks of MODEL/data, which causes
+# the same chunk to be read over and over again for every parameter slice.
+H5_CHUNK_CACHE = dict(
+    rdcc_nbytes=512 * 1024 * 1024, rdcc_nslots=1_000_003, rdcc_w0=0.75
+)
+
+
+@functools.lru_cache(maxsize=128)
+def _parameter_indices(dim_labels, parameters):
+    """
+    Parse the DIMENSION_LABELS attribute of MODEL/data and find the
+    indices of the parameters in it.
+
+    :param dim_labels: Label string, such as "[ VPV | VPH | ... ]"
+    :type dim_labels: Union[str, bytes]
+    :param parameters: Parameters to look up
+    :type parameters: tuple
+    """
+    if not type(dim_labels) == str:
+        dim_labels = dim_labels.decode()
+    dim_labels = dim_labels[1:-1].replace(" ", "").split("|")
+    label_to_idx = {label: i for i, label in enumerate(dim_labels)}
+    return tuple(label_to_idx[param] for param in parameters)
+
 
 class Optimize(object):
 
@@ -40,6 +63,9 @@ class Optimize(object):
     optimizer_name = "BaseClass for optimizers. Don't instantiate. If you see this..."
     config_template_path = None
 
+    # The newest iteration number, only looked up on disk when needed
+    _iteration_number = None
+
     def __init__(self, comm):
 
         # This init is only called by derived classes
@@ -52,8 +78,7 @@ class Optimize(object):
         )
 
         self.parameters = self.comm.project.inversion_params
-        if not os.path.exists(self.opt_folder):
-            os.mkdir(self.opt_folder)
+        os.makedirs(self.opt_folder, exist_ok=True)
 
         # These folders are universally needed
         self.model_dir = self.opt_folder / "MODELS"
@@ -159,7 +184,7 @@ class Optimize(object):
 
         if not os.path.exists(self.config_file):
             raise Exception("Can't read the ADAM config file")
-        config = toml.load(self.config_file)
+        config = read_toml(self.config_file)
         self.initial_model = config["initial_model"]
         self.step_length = config["step_length"]
         if "max_iterations" in config.keys():
@@ -177,7 +202,16 @@ class Optimize(object):
     @property
     def iteration_number(self):
         "Returns the number of the newest iteration"
-        return max(self.find_iteration_numbers())
+        if self._iteration_number is None:
+            self._iteration_number = max(self.find_iteration_numbers())
+        return self._iteration_number
+
+    def invalidate_iteration_cache(self):
+        """
+        Needs to be called whenever a new model is written into the model
+        folder, so the iteration number is looked up again.
+        """
+        self._iteration_number = None
 
     @property
     def iteration_name(self):
@@ -194,25 +228,33 @@ class Optimize(object):
         )
 
     def find_iteration_numbers(self):
-        models = glob.glob(f"{self.model_dir}/*.h5")
-        if len(models) == 0:
+        if not os.path.isdir(self.model_dir):
+            return [0]
+        # Models are named model_{iteration_number:05d}.h5
+        with os.scandir(self.model_dir) as it:
+            iteration_numbers = [
+                int(entry.name[6:-3])
+                for entry in it
+                if entry.name.startswith("model_") and entry.name.endswith(".h5")
+            ]
+        if len(iteration_numbers) == 0:
             return [0]
-        iteration_numbers = []
-        for model in models:
-            iteration_numbers.append(int(model.split(".")[0].split("_")[-1]))
         return iteration_numbers
 
     def _pick_data_for_iteration(self):
-        all_events = self.comm.lasif.list_events()
-        blocked_data = list(
-            set(self.comm.project.validation_dataset + self.comm.project.test_dataset)
+        from lasif.tools.query_gcmt_catalog import get_random_mitchell_subset
+
+        blocked_data = frozenset(self.comm.project.validation_dataset) | frozenset(
+            self.comm.project.test_dataset
         )
-        all_events = list(set(all_events) - set(blocked_data))
+        # Build the set once and do all the set arithmetic on it
+        avail_events = self.comm.lasif.list_events_set() - blocked_data
+        all_events = list(avail_events)
         n_events = self.comm.project.batch_size
         all_norms_path = self.gradient_norm_dir / "all_norms.toml"
         if os.path.exists(all_norms_path):
             norm_dict = toml.load(all_norms_path)
-            unused_events = list(set(all_events).difference(set(norm_dict.keys())))
+            unused_events = list(avail_events.difference(norm_dict.keys()))
             list_of_vals = np.array(list(norm_dict.values()))
             # Set unused to 65%, so slightly above average
             max_norm = np.percentile(list_of_vals, 65.0)
@@ -267,6 +309,9 @@ class Optimize(object):
         :param events: Pass a list of events if you want them to be predefined, defaults to None
         :type events: List[str], optional
         """
+
+        from salvus.flow.api import get_site
+
         self.comm.project.change_attribute("current_iteration", it_name)
         print("Preparing iteration for", it_name)
         if self.comm.lasif.has_iteration(it_name):
@@ -433,50 +478,48 @@ class Optimize(object):
                     avg_model_name)
         self.set_h5_data(filename=avg_model_name, data=average_model)
 
+    def _parameter_indices_of(self, h5_data):
+        # Get dimension indices of relevant parameters
+        # These should be constant for all gradients, so the parsing
+        # is only done once.
+        dim_labels = h5_data.attrs.get("DIMENSION_LABELS")[1]
+        return list(_parameter_indices(dim_labels, tuple(self.parameters)))
+
     def get_parameter_indices(self, filename):
         """Get parameter indices in h5 file"""
         with h5py.File(filename, "r") as h5:
-            h5_data = h5["MODEL/data"]
-            # Get dimension indices of relevant parameters
-            # These should be constant for all gradients, so this is only done
-            # once.
-            dim_labels = h5_data.attrs.get("DIMENSION_LABELS")[1][1:-1]
-            if not type(dim_labels) == str:
-                dim_labels = dim_labels.decode()
-            dim_labels = dim_labels.replace(" ", "").split("|")
-            indices = []
-            for param in self.parameters:
-                indices.append(dim_labels.index(param))
-        return indices
+            return self._parameter_indices_of(h5["MODEL/data"])
 
     def get_h5_data(self, filename):
         """
         Returns the relevant data in the form of ND_array with all the data.
         """
-        indices = self.get_parameter_indices(filename)
-
-        with h5py.File(filename, "r") as h5:
-            data = h5["MODEL/data"][:, :, :].copy()
-            return data[:, indices, :]
+        with h5py.File(filename, "r", **H5_CHUNK_CACHE) as h5:
+            dset = h5["MODEL/data"]
+            indices = self._parameter_indices_of(dset)
+            # Only read the planes of the relevant parameters from the file,
+            # straight into the output array.
+            data = np.empty(
+                (dset.shape[0], len(indices), dset.shape[2]), dtype=dset.dtype
+            )
+            for i, idx in enumerate(indices):
+                dset.read_direct(
+                    data, source_sel=np.s_[:, idx, :], dest_sel=np.s_[:, i, :]
+                )
+        return data
 
     def set_h5_data(self, filename, data, create_xdmf=True):
         """Writes the data with shape [:, indices :]. Requires existing file."""
         if not os.path.exists(filename):
             raise Exception("only works on existing files.")
 
-        indices = self.get_parameter_indices(filename)
-
-        with h5py.File(filename, "r+") as h5:
+        with h5py.File(filename, "r+", **H5_CHUNK_CACHE) as h5:
             dat = h5["MODEL/data"]
-            data_copy = dat[:, :, :].copy()
-            # avoid writing the file many times. work on array in memory
-            for i in range(len(indices)):
-                data_copy[:, indices[i], :] = data[:, i, :]
-
-            # writing only works in sorted order. This sort can only happen after
-            # the above executed to preserve the ordering that data came in
-            indices.sort()
-            dat[:, indices, :] = data_copy[:, indices, :]
+            indices = self._parameter_indices_of(dat)
+            # Write one parameter plane at a time, there is no need to read
+            # and rewrite the parameters that are left unchanged.
+            for i, idx in enumerate(indices):
+                dat[:, idx, :] = data[:, i, :]
 
         if create_xdmf:
             write_xdmf(filename)
@@ -488,6 +531,5 @@ class Optimize(object):
         :type filename: str
         """
         with h5py.File(filename, "r") as h5:
-            num_gll = h5["MODEL"]["coordinates"].shape[1]
-            dimension = h5["MODEL"]["coordinates"].shape[2]
+            _, num_gll, dimension = h5["MODEL/coordinates"].shape
         return round(num_gll ** (1 / dimension) - 1)
@@ -33,8 +33,7 @@ class SalvusOpt(Optimize):
         )
         self.models = self.opt_folder / "MODELS"
 
-        if not os.path.exists(self.opt_folder):
-            os.mkdir(self.opt_folder)
+        os.makedirs(self.opt_folder, exist_ok=True)
         self.config_file = self.opt_folder / "opt_config.toml"
 
         self.model_dir = self.opt_folder / "MODELS"
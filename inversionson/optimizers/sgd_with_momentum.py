@@ -11,7 +11,7 @@ from inversionson import InversionsonError
 from inversionson.optimizers.optimizer import Optimize
 from inversionson.helpers.regularization_helper import RegularizationHelper
 from inversionson.helpers.gradient_summer import GradientSummer
-from inversionson.utils import write_xdmf
+from inversionson.utils import write_xdmf, read_toml
 
 
 class SGDM(Optimize):
@@ -102,7 +102,7 @@ class SGDM(Optimize):
         """Reads the config file."""
         if not os.path.exists(self.config_file):
             raise Exception("Can't read the SGDM config file")
-        config = toml.load(self.config_file)
+        config = read_toml(self.config_file)
 
         self.initial_model = config["initial_model"]
         self.alpha = config["alpha"]
@@ -149,10 +149,10 @@ class SGDM(Optimize):
         ]
 
         for folder in folders:
-            if not os.path.exists(folder):
-                os.mkdir(folder)
+            os.makedirs(folder, exist_ok=True)
 
         shutil.copy(self.initial_model, self.model_path)
+        self.invalidate_iteration_cache()
         write_xdmf(self.model_path)
 
     def _issue_first_task(self):
@@ -273,9 +273,10 @@ class SGDM(Optimize):
             with h5py.File(self.moment_path, "r+") as h5:
                 data = h5["MODEL/data"]
 
-                # initialize with zeros
+                # initialize with zeros, no need to read the planes first
+                zeros = np.zeros((data.shape[0], data.shape[2]), dtype=data.dtype)
                 for i in indices:
-                    data[:, i, :] = np.zeros_like(data[:, i, :])
+                    data[:, i, :] = zeros
 
         v_t = self.beta * self.get_h5_data(self.moment_path) + (1 - self.beta) * g_t
 
@@ -602,5 +603,6 @@ class SGDM(Optimize):
                     self.iteration_number + 1, self.model_path
                 ),
             )
+            self.invalidate_iteration_cache()
         else:
             self._update_task_file()
@@ -1,22 +1,67 @@
 import multi_mesh.api
+import contextlib
+import dataclasses
 import sys
 import toml
 import os
 import shutil
 import pathlib
 import h5py
+import numpy as np
 from inversionson.hpc_processing.utils import build_or_get_receiver_info
 from inversionson.hpc_processing.cut_and_clip import (
     cut_source_region_from_gradient,
     clip_gradient,
 )
 
+# The script is uploaded on every run, but the inversionson package on
+# the cluster is not, so this can not come from inversionson.utils.
+try:
+    import tomllib
+except ImportError:
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+# rtoml is a lot faster at writing the receiver heavy simulation dicts
+try:
+    import rtoml
+except ImportError:
+    rtoml = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MOMENT_TENSOR_COMPONENTS = ("mrr", "mtt", "mpp", "mtp", "mrp", "mrt")
+
+# The script always runs in the job directory, so these never change
+_CWD = pathlib.Path.cwd()
+_OUTPUT_MESH = pathlib.Path("output", "mesh.h5")
+
+# Interpolated together in a single multi_mesh pass, which finds the
+# elements and evaluates the weights once for all of them
+INTERPOLATION_PARAMETERS = ["VPV", "VPH", "VSV", "VSH", "RHO"]
+
 # Here we should handle all the looking at the different mesh folders.
 # If the mesh does not exist on scratch, we check on non-scratch.
 # The from_mesh also needs to be found on either one of the two.
 # This needs to be implemented on Monday/Saturday/Tuesday
 
 
+def read_toml(filename):
+    """
+    Read a toml file with tomllib (or tomli) if available, as it is a lot
+    faster than the toml package.
+    """
+    if tomllib is None:
+        return toml.load(filename)
+    with open(filename, "rb") as fh:
+        return tomllib.load(fh)
+
+
 def cut_and_clip(
     gradient_filename,
     source_location,
@@ -61,88 +106,271 @@ def process_data(processing_info):
     preprocessing_function_asdf(processing_info)
 
 
-def create_mesh(mesh_info, source_info):
-    mesh_location = os.path.join(
-        mesh_info["mesh_folder"], mesh_info["event_name"], "mesh.h5"
-    )
-    long_term_mesh_location = os.path.join(
-        mesh_info["long_term_mesh_folder"], mesh_info["event_name"], "mesh.h5"
-    )
-    if os.path.exists(mesh_location):
-        print("Mesh already exists, copying it to here")
-        shutil.copy(mesh_location, "./to_mesh.h5")
-        return
-    elif os.path.exists(long_term_mesh_location):
-        print("Mesh already exists, copying it to here")
-        shutil.copy(long_term_mesh_location, "./to_mesh.h5")
-        return
-    else:
-        from salvus.mesh.simple_mesh import SmoothieSEM
-
-        sm = SmoothieSEM()
-        sm.basic.model = "prem_ani_one_crust"
-        sm.basic.min_period_in_seconds = float(mesh_info["min_period"])
-        sm.basic.elements_per_wavelength = float(mesh_info["elems_per_wavelength"])
-        sm.basic.number_of_lateral_elements = int(mesh_info["elems_per_quarter"])
-        sm.advanced.tensor_order = 4
-        if "ellipticity" in mesh_info.keys():
-            sm.spherical.ellipticity = float(mesh_info["ellipticity"])
-        if "ocean_loading" in mesh_info.keys():
-            sm.ocean.bathymetry_file = mesh_info["ocean_loading"]["remote_path"]
-            sm.ocean.bathymetry_varname = mesh_info["ocean_loading"]["variable"]
-            sm.ocean.ocean_layer_style = "loading"
-            sm.ocean.ocean_layer_density = 1025.0
-        if "topography" in mesh_info.keys():
-            sm.topography.topography_file = mesh_info["topography"]["remote_path"]
-            sm.topography.topography_varname = mesh_info["topography"]["variable"]
-        sm.source.latitude = float(source_info["latitude"])
-        sm.source.longitude = float(source_info["longitude"])
-        sm.refinement.lateral_refinements.append(
-            {"theta_min": 40.0, "theta_max": 140.0, "r_min": 6250.0}
+def _fast_clone(src, dst, link=False):
+    """
+    Copy a file without moving the bytes through user space when possible.
+
+    If link is True, a hard link is tried first. Only use that when neither
+    file is modified in place afterwards. Otherwise copy_file_range is used,
+    which reflinks on file systems that support it (XFS, Btrfs, ...).
+    Falls back to a normal copy.
+
+    dst is unlinked first, so that a file hard linked to it is not
+    truncated along with it.
+    """
+    try:
+        os.remove(dst)
+    except FileNotFoundError:
+        pass
+    if link:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(
+                        fsrc.fileno(), fdst.fileno(), remaining
+                    )
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            if remaining == 0:
+                return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+
+
+@dataclasses.dataclass(frozen=True)
+class MeshPaths:
+    """
+    All the mesh files a job touches, built once from the mesh_info.
+    """
+
+    scratch: pathlib.Path
+    long_term: pathlib.Path
+    standard_gradient: pathlib.Path
+    output: pathlib.Path = _OUTPUT_MESH
+
+    @classmethod
+    def from_mesh_info(cls, mesh_info):
+        mesh_folder = pathlib.Path(mesh_info["mesh_folder"])
+        return cls(
+            scratch=mesh_folder / mesh_info["event_name"] / "mesh.h5",
+            long_term=pathlib.Path(
+                mesh_info["long_term_mesh_folder"], mesh_info["event_name"], "mesh.h5"
+            ),
+            standard_gradient=mesh_folder / "standard_gradient" / "mesh.h5",
         )
-        m = sm.create_mesh()
-        m.write_h5("to_mesh.h5", mode="all")
 
 
-def get_standard_gradient(mesh_info):
-    remote_gradient = (
-        pathlib.Path(mesh_info["mesh_folder"]) / "standard_gradient" / "mesh.h5"
+def create_mesh(mesh_info, source_info, mesh_paths):
+    # Just try to copy the mesh instead of checking if it exists first
+    for location in [mesh_paths.scratch, mesh_paths.long_term]:
+        try:
+            _fast_clone(location, mesh_paths.output)
+        except FileNotFoundError:
+            continue
+        print("Mesh already exists, copied it to here")
+        return
+
+    from salvus.mesh.simple_mesh import SmoothieSEM
+
+    sm = SmoothieSEM()
+    sm.basic.model = "prem_ani_one_crust"
+    sm.basic.min_period_in_seconds = float(mesh_info["min_period"])
+    sm.basic.elements_per_wavelength = float(mesh_info["elems_per_wavelength"])
+    sm.basic.number_of_lateral_elements = int(mesh_info["elems_per_quarter"])
+    sm.advanced.tensor_order = 4
+    ellipticity = mesh_info.get("ellipticity")
+    if ellipticity is not None:
+        sm.spherical.ellipticity = float(ellipticity)
+    ocean_loading = mesh_info.get("ocean_loading")
+    if ocean_loading is not None:
+        sm.ocean.bathymetry_file = ocean_loading["remote_path"]
+        sm.ocean.bathymetry_varname = ocean_loading["variable"]
+        sm.ocean.ocean_layer_style = "loading"
+        sm.ocean.ocean_layer_density = 1025.0
+    topography = mesh_info.get("topography")
+    if topography is not None:
+        sm.topography.topography_file = topography["remote_path"]
+        sm.topography.topography_varname = topography["variable"]
+    sm.source.latitude = float(source_info["latitude"])
+    sm.source.longitude = float(source_info["longitude"])
+    sm.refinement.lateral_refinements.append(
+        {"theta_min": 40.0, "theta_max": 140.0, "r_min": 6250.0}
     )
+    m = sm.create_mesh()
+    m.write_h5(str(mesh_paths.output), mode="all")
+    _rechunk_mesh(mesh_paths.output)
 
-    shutil.copy(remote_gradient, "./to_mesh.h5")
+
+def _element_chunks(dataset, target_nbytes):
+    """
+    Chunk shape of about target_nbytes that spans whole elements, or None
+    if the chunks of the dataset are fine (256 KiB - 4 MiB) as they are.
+    """
+    if dataset.chunks is None or dataset.size == 0:
+        return None
+    itemsize = dataset.dtype.itemsize
+    if 256 * 1024 <= np.prod(dataset.chunks) * itemsize <= 4 * 1024 * 1024:
+        return None
+    row_nbytes = max(int(np.prod(dataset.shape[1:])) * itemsize, 1)
+    rows = min(dataset.shape[0], max(1, target_nbytes // row_nbytes))
+    return (rows,) + dataset.shape[1:]
 
 
-def move_mesh(mesh_folder, event_name):
-    mesh_location = pathlib.Path(mesh_folder) / event_name / "mesh.h5"
+def _copy_attrs(src, dst):
+    for key in src.attrs:
+        dst.attrs.create(key, src.attrs[key], dtype=src.attrs.get_id(key).dtype)
+
+
+def _only_groups_and_datasets(group):
+    """
+    True if everything in the file below group is a group or a dataset that
+    is reached through a single hard link, so copying it object by object
+    loses nothing.
+    """
+    for name in group:
+        link = group.get(name, getlink=True)
+        if not isinstance(link, h5py.HardLink):
+            return False
+        obj = group[name]
+        if h5py.h5o.get_info(obj.id).rc != 1:
+            return False
+        if isinstance(obj, h5py.Group):
+            if not _only_groups_and_datasets(obj):
+                return False
+        elif not isinstance(obj, h5py.Dataset):
+            return False
+    return True
+
+
+def _rechunk_mesh(filename, target_nbytes=1024 * 1024):
+    """
+    Give chunked datasets with very small (< 256 KiB) or very large
+    (> 4 MiB) chunks chunks of about target_nbytes along the element axis,
+    which is how the mesh is read during interpolation and simulation.
+
+    h5py can not change the chunking of an existing dataset, so the mesh is
+    rewritten into a new file which then replaces it. Files with soft or
+    external links, committed datatypes or objects linked more than once are
+    left as they are.
+    """
+    with h5py.File(filename, "r") as f:
+        if not _only_groups_and_datasets(f):
+            return
+        datasets = []
+        f.visititems(
+            lambda name, obj: datasets.append(obj)
+            if isinstance(obj, h5py.Dataset)
+            else None
+        )
+        if all(_element_chunks(d, target_nbytes) is None for d in datasets):
+            return
+
+    tmp_filename = f"{filename}.rechunk"
+    try:
+        with h5py.File(filename, "r") as src, h5py.File(tmp_filename, "w") as dst:
+            _copy_attrs(src, dst)
+
+            def copy(name, obj):
+                if isinstance(obj, h5py.Group):
+                    _copy_attrs(obj, dst.create_group(name))
+                    return
+                chunks = _element_chunks(obj, target_nbytes)
+                if chunks is None:
+                    src.copy(obj, dst, name=name)
+                    return
+                new = dst.create_dataset(
+                    name,
+                    shape=obj.shape,
+                    dtype=obj.dtype,
+                    chunks=chunks,
+                    maxshape=obj.maxshape,
+                    compression=obj.compression,
+                    compression_opts=obj.compression_opts,
+                    shuffle=obj.shuffle,
+                    fletcher32=obj.fletcher32,
+                    fillvalue=obj.fillvalue,
+                )
+                # Copy a few chunks at a time to keep the memory bounded
+                step = chunks[0] * 16
+                for start in range(0, obj.shape[0], step):
+                    new[start : start + step] = obj[start : start + step]
+                _copy_attrs(obj, new)
+
+            src.visititems(copy)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+    os.replace(tmp_filename, filename)
+
+
+def get_standard_gradient(mesh_paths):
+    _fast_clone(mesh_paths.standard_gradient, mesh_paths.output)
+
+
+def move_mesh(mesh_paths):
+    mesh_location = mesh_paths.scratch
     if not os.path.exists(mesh_location):
         if not os.path.exists(mesh_location.parent):
             os.makedirs(mesh_location.parent)
         print("Copying mesh for storage")
-        shutil.copy("./output/mesh.h5", mesh_location)
+        # The output mesh is not written to in place after this and
+        # _fast_clone unlinks before writing, so they can share the data
+        _fast_clone(mesh_paths.output, mesh_location, link=True)
+
+
+@contextlib.contextmanager
+def _h5_chunk_cache(rdcc_nbytes=256 * 1024 * 1024, rdcc_nslots=1_000_003, rdcc_w0=0.75):
+    """
+    Make every h5py.File opened within the context use a larger raw data
+    chunk cache, unless the caller asks for something else. multi_mesh only
+    takes paths, so this is how its reads of the meshes get the bigger cache.
+    The default cache of 1 MiB is smaller than a single chunk of the meshes.
+    """
+    original_init = h5py.File.__init__
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("rdcc_nbytes", rdcc_nbytes)
+        kwargs.setdefault("rdcc_nslots", rdcc_nslots)
+        kwargs.setdefault("rdcc_w0", rdcc_w0)
+        original_init(self, *args, **kwargs)
+
+    h5py.File.__init__ = __init__
+    try:
+        yield
+    finally:
+        h5py.File.__init__ = original_init
 
 
 def interpolate_fields(from_mesh, to_mesh, layers, parameters, stored_array=None):
-    multi_mesh.api.gll_2_gll_layered_multi_two(
-        from_gll=from_mesh,
-        to_gll=to_mesh,
-        nelem_to_search=30,
-        parameters=parameters,
-        layers="nocore",
-        stored_array=stored_array,
-        make_spherical=True
-    )
+    with _h5_chunk_cache():
+        multi_mesh.api.gll_2_gll_layered_multi_two(
+            from_gll=from_mesh,
+            to_gll=to_mesh,
+            nelem_to_search=30,
+            parameters=parameters,
+            layers="nocore",
+            stored_array=stored_array,
+            make_spherical=True
+        )
 
 
-def move_nodal_field_to_gradient(mesh_info, field):
+def move_nodal_field_to_gradient(mesh_paths, field):
     """
     This is for moving a (z_node_1D) field from forward mesh to gradient
     """
     from salvus.mesh.unstructured_mesh import UnstructuredMesh as um
 
-    mesh_location = os.path.join(
-        mesh_info["mesh_folder"], mesh_info["event_name"], "mesh.h5"
-    )
-    m_for = um.from_h5(mesh_location)
+    m_for = um.from_h5(str(mesh_paths.scratch))
     m_grad = um.from_h5("from_mesh.h5")
     m_grad.attach_field(field, m_for.element_nodal_fields[field])
     m_grad.write_h5("from_mesh.h5")
@@ -150,10 +378,15 @@ def move_nodal_field_to_gradient(mesh_info, field):
 
 
 def create_simulation_object(
-    mesh_info, source_info, receiver_info, simulation_info, multi_mesh
+    mesh_info,
+    source_info,
+    receiver_info,
+    simulation_info,
+    multi_mesh,
+    legacy_toml=False,
 ):
     """
-    Create the simulation object remotely and write it into a dictionary toml file.
+    Create the simulation object remotely and write it into a dictionary file.
     This dictionary is then downloaded and used locally to create the simulation object,
     bypassing the problem of slow receiver placements.
 
@@ -162,29 +395,45 @@ def create_simulation_object(
     """
     import salvus.flow.simple_config as sc
 
+    n_rec = len(receiver_info)
+    latitudes = np.fromiter(
+        (rec["latitude"] for rec in receiver_info), dtype=np.float64, count=n_rec
+    )
+    longitudes = np.fromiter(
+        (rec["longitude"] for rec in receiver_info), dtype=np.float64, count=n_rec
+    )
+    # Check all receivers at once, instead of failing on one of them deep
+    # inside Salvus
+    if not (np.isfinite(latitudes).all() and np.isfinite(longitudes).all()):
+        raise ValueError("Receiver coordinates need to be finite numbers.")
+    if (np.abs(latitudes) > 90.0).any() or (np.abs(longitudes) > 180.0).any():
+        raise ValueError("Receiver coordinates are out of range.")
+    moment_tensor = np.array(
+        [source_info[comp] for comp in MOMENT_TENSOR_COMPONENTS], dtype=np.float64
+    )
+    if not np.isfinite(moment_tensor).all():
+        raise ValueError("Moment tensor components need to be finite numbers.")
+    moment_tensor = dict(zip(MOMENT_TENSOR_COMPONENTS, moment_tensor.tolist()))
     receivers = [
         sc.receiver.seismology.SideSetPoint3D(
-            latitude=rec["latitude"],
-            longitude=rec["longitude"],
+            latitude=lat,
+            longitude=lon,
             network_code=rec["network-code"],
             station_code=rec["station-code"],
             depth_in_m=0.0,
             fields=["displacement"],
             side_set_name="r1",
         )
-        for rec in receiver_info
+        for lat, lon, rec in zip(
+            latitudes.tolist(), longitudes.tolist(), receiver_info
+        )
     ]
 
     src = sc.source.seismology.SideSetMomentTensorPoint3D(
         latitude=source_info["latitude"],
         longitude=source_info["longitude"],
         depth_in_m=source_info["depth_in_m"],
-        mrr=source_info["mrr"],
-        mtt=source_info["mtt"],
-        mpp=source_info["mpp"],
-        mtp=source_info["mtp"],
-        mrp=source_info["mrp"],
-        mrt=source_info["mrt"],
+        **moment_tensor,
         side_set_name=source_info["side_set"],
         source_time_function=sc.stf.Custom(
             filename=f"REMOTE:{source_info['stf']}", dataset_name="/source"
@@ -192,9 +441,9 @@ def create_simulation_object(
     )
 
     if multi_mesh:
-        mesh = pathlib.Path().resolve() / "output" / "mesh.h5"
+        mesh = _CWD / _OUTPUT_MESH
     else:
-        mesh = pathlib.Path().resolve() / "from_mesh.h5"
+        mesh = _CWD / "from_mesh.h5"
 
     w = sc.simulation.Waveform(mesh=mesh, sources=src)
     w.add_receivers(receivers, max_iterations=100000)
@@ -217,7 +466,7 @@ def create_simulation_object(
         )
         boundaries.append(absorbing)
 
-    if "ocean_loading" in mesh_info.keys():
+    if "ocean_loading" in mesh_info:
         print("Applying ocean loading.")
         bound = True
         ocean_loading = sc.boundary.OceanLoading(side_sets=[source_info["side_set"]])
@@ -249,20 +498,53 @@ def create_simulation_object(
     w.output.volume_data.filename = "output.h5"
     w.output.volume_data.fields = ["adjoint-checkpoint"]
     w.output.volume_data.sampling_interval_in_time_steps = checkpointing_flag
-    w.validate()
+    # Validating walks all the receivers again. The driver sets
+    # INVERSIONSON_SKIP_VALIDATE=1, as SalvusFlowComponent.simulation_from_dict
+    # validates the simulation when it is rebuilt from the dictionary.
+    if os.environ.get("INVERSIONSON_SKIP_VALIDATE") != "1":
+        w.validate()
+
+    write_simulation_dict(w.get_dictionary(), legacy_toml=legacy_toml)
 
-    with open("output/simulation_dict.toml", "w") as fh:
-        toml.dump(w.get_dictionary(), fh)
+
+def write_simulation_dict(sim_dict, legacy_toml=False):
+    """
+    Write the simulation dictionary to output/. msgpack is a lot faster to
+    write and read than toml for receiver heavy dictionaries, the toml file
+    is only written when asked for or when msgpack is not available.
+    """
+    if msgpack is not None:
+        with open("output/simulation_dict.msgpack", "wb") as fh:
+            msgpack.pack(sim_dict, fh, use_bin_type=True)
+    if legacy_toml or msgpack is None:
+        with open("output/simulation_dict.toml", "w") as fh:
+            if rtoml is not None:
+                # Leave out None values, like toml.dump does
+                fh.write(rtoml.dumps(sim_dict, none_value=None))
+            else:
+                toml.dump(sim_dict, fh)
 
 
 if __name__ == "__main__":
     """
-    Call with python name_of_script toml_filename
+    Call with python name_of_script toml_filename [--legacy-toml]
+    or with python name_of_script --dump-toml simulation_dict.msgpack
+    to print a simulation dictionary as toml.
     """
+    if sys.argv[1] == "--dump-toml":
+        if msgpack is None:
+            sys.exit("msgpack is needed to read simulation_dict.msgpack files")
+        with open(sys.argv[2], "rb") as fh:
+            toml.dump(msgpack.unpack(fh, raw=False), sys.stdout)
+        sys.exit(0)
     toml_filename = sys.argv[1]
 
-    info = toml.load(toml_filename)
+    info = read_toml(toml_filename)
     mesh_info = info["mesh_info"]
+    mesh_paths = MeshPaths.from_mesh_info(mesh_info)
+    # The mesh is put together in output/ right away, so there is no
+    # final move and the simulation object opens a freshly written file
+    os.makedirs(mesh_paths.output.parent, exist_ok=True)
 
     # Process data if it doesn't exist already
     if info["data_processing"]:
@@ -284,22 +566,23 @@ if __name__ == "__main__":
 
         simulation_info = info["simulation_info"]
         if info["multi-mesh"]:
-            create_mesh(mesh_info=mesh_info, source_info=source_info)
+            create_mesh(
+                mesh_info=mesh_info, source_info=source_info, mesh_paths=mesh_paths
+            )
             print("Mesh created or already existed")
     else:
         if info["multi-mesh"]:
-            get_standard_gradient(mesh_info=mesh_info)
-            move_nodal_field_to_gradient(mesh_info=mesh_info, field="z_node_1D")
+            get_standard_gradient(mesh_paths=mesh_paths)
+            move_nodal_field_to_gradient(mesh_paths=mesh_paths, field="z_node_1D")
 
-    if not os.path.exists(mesh_info["interpolation_weights"]):
-        os.makedirs(mesh_info["interpolation_weights"])
+    os.makedirs(mesh_info["interpolation_weights"], exist_ok=True)
 
     if info["multi-mesh"]:
         interpolate_fields(
             from_mesh="./from_mesh.h5",
-            to_mesh="./to_mesh.h5",
+            to_mesh=str(mesh_paths.output),
             layers="nocore",
-            parameters=["VPV", "VPH", "VSV", "VSH", "RHO"],
+            parameters=INTERPOLATION_PARAMETERS,
             stored_array=mesh_info["interpolation_weights"],
         )
         print("Fields interpolated")
@@ -308,19 +591,15 @@ if __name__ == "__main__":
     # for this if we have a job anyway.
     if info["gradient"]:
         cut_and_clip(
-            "./to_mesh.h5",
+            str(mesh_paths.output),
             info["source_location"],
             info["parameters"],
             info["cutout_radius_in_km"],
             info["clipping_percentile"],
         )
-    if info["multi-mesh"]:
-        shutil.move("./to_mesh.h5", "./output/mesh.h5")
     if not info["gradient"]:
         if info["multi-mesh"]:
-            move_mesh(
-                mesh_folder=mesh_info["mesh_folder"], event_name=mesh_info["event_name"]
-            )
+            move_mesh(mesh_paths=mesh_paths)
             print("Meshed moved to longer term storage")
         if info["create_simulation_dict"]:
             print("Creating simulation object")
@@ -330,4 +609,5 @@ if __name__ == "__main__":
                 receiver_info,
                 simulation_info,
                 info["multi-mesh"],
+                legacy_toml="--legacy-toml" in sys.argv,
             )
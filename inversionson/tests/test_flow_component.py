@@ -0,0 +1,61 @@
+import pytest
+import os
+import shutil
+
+from inversionson.tests.testing_helpers import DummyProject
+from inversionson.components import flow_comp
+
+event_name = "GCMT_event_TURKEY_Mag_5.1_2010-3-24-14"
+
+
+@pytest.fixture(scope="module")
+def pro():
+    # Create a physical tmp folder
+    # Create a project in there
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    project_path = os.path.join(dir_path, "tmp")
+    os.makedirs(project_path)
+    pro = DummyProject(project_path)
+    yield pro
+    # Here close everything down. Delete all folders.
+    shutil.rmtree(project_path)
+
+
+@pytest.fixture
+def dict_folder(pro):
+    folder = pro.comm.salvus_flow._simulation_dict_folder(event_name)
+    os.makedirs(folder, exist_ok=True)
+    yield folder
+    shutil.rmtree(folder)
+
+
+def test_find_local_simulation_dict_missing(pro):
+    assert pro.comm.salvus_flow.find_local_simulation_dict(event_name) is None
+
+
+def test_find_local_simulation_dict_toml(pro, dict_folder):
+    pro.dummy_file(dict_folder / "simulation_dict.toml")
+
+    found = pro.comm.salvus_flow.find_local_simulation_dict(event_name)
+    assert found == dict_folder / "simulation_dict.toml"
+
+
+@pytest.mark.skipif(flow_comp.msgpack is None, reason="msgpack not installed")
+def test_find_local_simulation_dict_prefers_msgpack(pro, dict_folder):
+    pro.dummy_file(dict_folder / "simulation_dict.toml")
+    pro.dummy_file(dict_folder / "simulation_dict.msgpack")
+
+    found = pro.comm.salvus_flow.find_local_simulation_dict(event_name)
+    assert found == dict_folder / "simulation_dict.msgpack"
+
+
+def test_find_local_simulation_dict_without_msgpack(pro, dict_folder, monkeypatch):
+    # A msgpack dict can't be read without msgpack, so it is ignored
+    monkeypatch.setattr(flow_comp, "msgpack", None)
+    pro.dummy_file(dict_folder / "simulation_dict.msgpack")
+
+    assert pro.comm.salvus_flow.find_local_simulation_dict(event_name) is None
+
+    pro.dummy_file(dict_folder / "simulation_dict.toml")
+    found = pro.comm.salvus_flow.find_local_simulation_dict(event_name)
+    assert found == dict_folder / "simulation_dict.toml"
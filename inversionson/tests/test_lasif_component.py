@@ -46,6 +46,7 @@ def test_has_iteration(pro, it_name):
     # pro = DummyProject(tmp_path)
 
     lasif.api.set_up_iteration(pro.comm.lasif.lasif_root, "init")
+    pro.comm.lasif.invalidate_iterations_cache()
 
     if "init" in it_name:
         assert pro.comm.lasif.has_iteration(it_name)
@@ -55,6 +56,18 @@ def test_has_iteration(pro, it_name):
     lasif.api.set_up_iteration(
         pro.comm.lasif.lasif_root, iteration="init", remove_dirs=True
     )
+    pro.comm.lasif.invalidate_iterations_cache()
+
+
+def test_removed_iteration_is_forgotten(pro):
+    pro.comm.lasif.set_up_iteration("init")
+    assert pro.comm.lasif.has_iteration("init")
+
+    lasif.api.set_up_iteration(
+        pro.comm.lasif.lasif_root, iteration="init", remove_dirs=True
+    )
+    pro.comm.lasif.invalidate_iterations_cache()
+    assert not pro.comm.lasif.has_iteration("init")
 
 
 @pytest.mark.parametrize("events", [[], [event_names[0]]])
@@ -74,6 +87,7 @@ def test_set_up_iteration(pro, events):
     lasif.api.set_up_iteration(
         pro.comm.lasif.lasif_root, iteration="init", remove_dirs=True
     )
+    pro.comm.lasif.invalidate_iterations_cache()
 
 
 @pytest.mark.parametrize("event", [event_names[0], event_names[1]])
@@ -93,6 +107,39 @@ def test_list_events(pro):
     assert set(events) == set(event_names)
 
 
+def test_list_events_set(pro):
+    events = pro.comm.lasif.list_events_set()
+
+    assert events == frozenset(event_names)
+    # The set of all events is only built once
+    assert pro.comm.lasif.list_events_set() is events
+
+
+def test_list_events_returns_a_copy(pro):
+    events = pro.comm.lasif.list_events()
+    events.append("not_an_event")
+
+    assert set(pro.comm.lasif.list_events()) == set(event_names)
+
+
+def test_already_processed(pro):
+    event = event_names[1]
+    processed_file = os.path.join(
+        pro.comm.lasif.lasif_comm.project.paths["preproc_eq_data"],
+        event,
+        f"preprocessed_{int(pro.comm.project.min_period)}s_to_"
+        f"{int(pro.comm.project.max_period)}s.h5",
+    )
+    assert not pro.comm.lasif._already_processed(event)
+
+    # Data processed after the first scan is still found
+    os.makedirs(os.path.dirname(processed_file), exist_ok=True)
+    pro.dummy_file(processed_file)
+    assert pro.comm.lasif._already_processed(event)
+
+    os.remove(processed_file)
+
+
 @pytest.mark.parametrize("event", [event_names[0], event_names[1]])
 def test_move_mesh(pro, event, capsys):
 
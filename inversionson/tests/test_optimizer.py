@@ -0,0 +1,74 @@
+import pytest
+import h5py
+import numpy as np
+
+from inversionson.optimizers.optimizer import Optimize
+
+labels = b"[ VPV | VSV | RHO ]"
+
+
+def bare_optimizer(parameters):
+    # Only the h5 helpers are tested, they don't need a project
+    opt = Optimize.__new__(Optimize)
+    opt.parameters = parameters
+    return opt
+
+
+@pytest.fixture
+def model_file(tmp_path):
+    filename = tmp_path / "model.h5"
+    with h5py.File(filename, "w") as f:
+        data = f.create_dataset(
+            "MODEL/data", data=np.random.rand(10, 3, 27), chunks=(5, 3, 27)
+        )
+        data.attrs["DIMENSION_LABELS"] = [b"element", labels, b"point"]
+        f.create_dataset("MODEL/coordinates", data=np.zeros((10, 27, 3)))
+    return filename
+
+
+@pytest.mark.parametrize(
+    "parameters, indices", [(["VPV"], [0]), (["VSV", "VPV"], [1, 0]), (["RHO"], [2])]
+)
+def test_get_parameter_indices(model_file, parameters, indices):
+    opt = bare_optimizer(parameters)
+    assert opt.get_parameter_indices(model_file) == indices
+
+
+def test_get_h5_data(model_file):
+    opt = bare_optimizer(["VSV", "RHO"])
+    with h5py.File(model_file, "r") as f:
+        expected = f["MODEL/data"][:, [1, 2], :]
+
+    np.testing.assert_array_equal(opt.get_h5_data(model_file), expected)
+
+
+def test_set_h5_data(model_file):
+    opt = bare_optimizer(["RHO", "VPV"])
+    with h5py.File(model_file, "r") as f:
+        before = f["MODEL/data"][:]
+
+    new = np.ones((10, 2, 27))
+    new[:, 1, :] = 2.0
+    opt.set_h5_data(model_file, new, create_xdmf=False)
+
+    with h5py.File(model_file, "r") as f:
+        after = f["MODEL/data"][:]
+    np.testing.assert_array_equal(after[:, 2, :], 1.0)
+    np.testing.assert_array_equal(after[:, 0, :], 2.0)
+    # Parameters that are not inverted for are left alone
+    np.testing.assert_array_equal(after[:, 1, :], before[:, 1, :])
+
+
+def test_files_are_closed_after_use(model_file):
+    # Another optimizer has to be able to write to a file which was read
+    reader = bare_optimizer(["VPV"])
+    writer = bare_optimizer(["VPV"])
+    data = reader.get_h5_data(model_file)
+
+    writer.set_h5_data(model_file, data * 2.0, create_xdmf=False)
+    np.testing.assert_allclose(reader.get_h5_data(model_file), data * 2.0)
+
+
+def test_get_tensor_order(model_file):
+    opt = bare_optimizer(["VPV"])
+    assert opt.get_tensor_order(model_file) == 2
@@ -0,0 +1,30 @@
+import pytest
+import toml
+
+from inversionson import utils
+
+content = {"initial_model": "model.h5", "alpha": 0.001, "smoothing": [1.0, 2.0]}
+
+
+@pytest.fixture
+def toml_file(tmp_path):
+    filename = tmp_path / "config.toml"
+    with open(filename, "w") as fh:
+        toml.dump(content, fh)
+    return filename
+
+
+def test_read_toml(toml_file):
+    assert utils.read_toml(toml_file) == content
+
+
+def test_read_toml_without_tomllib(toml_file, monkeypatch):
+    # Falls back to the toml package
+    monkeypatch.setattr(utils, "tomllib", None)
+    assert utils.read_toml(toml_file) == content
+
+
+def test_read_toml_with_tomli(toml_file, monkeypatch):
+    tomli = pytest.importorskip("tomli")
+    monkeypatch.setattr(utils, "tomllib", tomli)
+    assert utils.read_toml(toml_file) == content
@@ -12,6 +12,16 @@ import inspect
 import os, sys
 import h5py
 import time
+import toml
+
+# Prefer a fast parser for reading toml files, if one is available.
+try:
+    import tomllib
+except ImportError:
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
 
 
 FILE_TEMPLATES_DIR = os.path.join(
@@ -25,6 +35,22 @@ BASE_XDMF_PATH = os.path.join(FILE_TEMPLATES_DIR, "base_xdmf.xdmf")
 XDMF_ATTRIBUTE_PATH = os.path.join(FILE_TEMPLATES_DIR, "attribute.xdmf")
 
 
+def read_toml(filename):
+    """
+    Reads a toml file. Uses tomllib (or tomli) when available, as it is
+    a lot faster than the pure python toml package.
+
+    :param filename: Path to the toml file
+    :type filename: Union[str, pathlib.Path]
+    :return: The parsed content
+    :rtype: dict
+    """
+    if tomllib is None:
+        return toml.load(filename)
+    with open(filename, "rb") as fh:
+        return tomllib.load(fh)
+
+
 def write_xdmf(filename):
     """
     Takes a path to an h5 file and writes the accompanying xdmf file.